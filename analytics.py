@@ -0,0 +1,92 @@
+import argparse
+
+from main import EVENT_DRAIN, EVENT_LAUNCH, EVENT_MAX_BUMPERS
+from trajectory import DEFAULT_CHUNK_RECORDS, TrajectoryArchive
+
+# 軌跡アーカイブ (trajectory.py) の集計
+# アーカイブをチャンク単位で順に読むだけなので、アーカイブがどれだけ大きくてもメモリ使用量は一定
+
+PLAYFIELD_W = 160
+PLAYFIELD_H = 240
+DRAIN_BIN_W = 8  # 落ちた位置のヒストグラムのビン幅 (ピクセル)
+
+
+def analyze(archive, chunk_records=DEFAULT_CHUNK_RECORDS):
+    """アーカイブ全体を集計して結果の辞書を返す
+
+    heatmap:      PLAYFIELD_H x PLAYFIELD_W のボールの滞在フレーム数 (行優先の1次元リスト)
+    bumper_hits:  バンパーごとのヒット数
+    drain_hist:   ボールが落ちる直前のX座標のヒストグラム (DRAIN_BIN_W ピクセルごと)
+    launches, drains, frames: 発射回数、ボールロスト回数、総フレーム数
+    """
+    heatmap = [0] * (PLAYFIELD_W * PLAYFIELD_H)
+    bumper_hits = [0] * EVENT_MAX_BUMPERS
+    drain_hist = [0] * ((PLAYFIELD_W + DRAIN_BIN_W - 1) // DRAIN_BIN_W)
+    launches = 0
+    drains = 0
+    frames = 0
+
+    # ボールロストのフレームではボールがプランジャー位置に戻っているので、1つ前のフレームの位置を使う
+    prev_x = None
+    for chunk in archive.iter_chunks(chunk_records):
+        for _frame, x, y, _vx, _vy, _flipper_l, _flipper_r, events in chunk:
+            frames += 1
+            px = int(x)
+            py = int(y)
+            if 0 <= px < PLAYFIELD_W and 0 <= py < PLAYFIELD_H:
+                heatmap[py * PLAYFIELD_W + px] += 1
+
+            if events:
+                if events & EVENT_DRAIN:
+                    drains += 1
+                    if prev_x is not None:
+                        drain_x = min(max(int(prev_x), 0), PLAYFIELD_W - 1)
+                        drain_hist[drain_x // DRAIN_BIN_W] += 1
+                if events & EVENT_LAUNCH:
+                    launches += 1
+                bumper_bits = events & ((1 << EVENT_MAX_BUMPERS) - 1)
+                while bumper_bits:
+                    lowest = bumper_bits & -bumper_bits
+                    bumper_hits[lowest.bit_length() - 1] += 1
+                    bumper_bits ^= lowest
+            prev_x = x
+
+    # 使われていない末尾のバンパー枠は落とす
+    while bumper_hits and bumper_hits[-1] == 0:
+        bumper_hits.pop()
+
+    return {
+        "heatmap": heatmap,
+        "bumper_hits": bumper_hits,
+        "drain_hist": drain_hist,
+        "launches": launches,
+        "drains": drains,
+        "frames": frames,
+    }
+
+
+def write_heatmap_pgm(path, heatmap):
+    """ヒートマップをグレースケールの PGM 画像として書き出す"""
+    peak = max(heatmap) or 1
+    pixels = bytes(min(255, count * 255 // peak) for count in heatmap)
+    with open(path, "wb") as f:
+        f.write(f"P5 {PLAYFIELD_W} {PLAYFIELD_H} 255\n".encode())
+        f.write(pixels)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a trajectory archive")
+    parser.add_argument("path")
+    parser.add_argument("--heatmap", help="write the ball-density heatmap to this PGM file")
+    args = parser.parse_args()
+
+    with TrajectoryArchive(args.path) as archive:
+        result = analyze(archive)
+        print(f"games={len(archive)} frames={result['frames']} launches={result['launches']} drains={result['drains']}")
+
+    for index, hits in enumerate(result["bumper_hits"]):
+        print(f"bumper {index}: {hits}")
+    for index, count in enumerate(result["drain_hist"]):
+        print(f"drain x={index * DRAIN_BIN_W:3d}-{(index + 1) * DRAIN_BIN_W - 1:3d}: {count}")
+    if args.heatmap:
+        write_heatmap_pgm(args.heatmap, result["heatmap"])
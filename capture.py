@@ -0,0 +1,200 @@
+import argparse
+import collections
+import ctypes
+import queue
+import struct
+import threading
+import zlib
+
+import pyxel
+
+# ゲーム内録画: 描画した画面 (パレット番号の 160x240 バイト) を記録する
+#
+# draw() の最後に capture_frame() を呼ぶと、空いているリングバッファに画面をコピーして
+# キューに積むだけで戻る。エンコードはバックグラウンドのスレッドで行う。
+# 空きバッファがない (エンコードが追いつかない) 場合は待たずにそのフレームを捨てる。
+#
+# エンコードしたフレームは直近 replay_seconds 秒分をメモリにも保持しておき、save_replay() で
+# ファイルに書き出せる (直前のプレイの保存)。書き出しもエンコード用のスレッドで行う。
+#
+# ファイル形式 (リトルエンディアン):
+#   ヘッダ: MAGIC, width (uint16), height (uint16)
+#   フレーム: frame (uint32), flags (uint8), 圧縮後のサイズ (uint32), zlib で圧縮したデータ
+#     flags & FLAG_KEYFRAME ならデータは画面そのもの、そうでなければ前のフレームとの XOR
+#   台はほとんど動かないので XOR 差分はほぼ 0 になり、よく圧縮できる
+
+MAGIC = b"PBCAP1"
+HEADER_FORMAT = "<HH"
+FRAME_HEADER_FORMAT = "<IBI"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+FLAG_KEYFRAME = 1
+
+DEFAULT_RING_SIZE = 8      # 画面コピー用のバッファ数 (エンコード待ちの最大フレーム数)
+DEFAULT_KEYFRAME_INTERVAL = 300 # この間隔で差分ではなく画面全体を書く (途中から読めるように)
+DEFAULT_REPLAY_SECONDS = 10
+DEFAULT_FPS = 30
+CLOSE_TIMEOUT = 5.0 # close() でエンコード用のスレッドの終了を待つ上限 (秒)
+
+
+class FrameCapture:
+    def __init__(self, path=None, width=160, height=240, ring_size=DEFAULT_RING_SIZE, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                 replay_seconds=DEFAULT_REPLAY_SECONDS, fps=DEFAULT_FPS):
+        """path が None ならプレイ全体は録画せず、直前のプレイの保存用に直近のフレームだけ保持する"""
+        self.width = width
+        self.height = height
+        self.frame_size = width * height
+        self.keyframe_interval = keyframe_interval
+
+        # 事前に確保したリングバッファと、その先頭アドレス (ctypes.memmove でコピーするため)
+        self.ring = [bytearray(self.frame_size) for _ in range(ring_size)]
+        self.ring_addresses = [ctypes.addressof((ctypes.c_char * self.frame_size).from_buffer(buf)) for buf in self.ring]
+        self.free_slots = queue.Queue()
+        for slot in range(ring_size):
+            self.free_slots.put(slot)
+        self.filled_slots = queue.Queue(maxsize=ring_size)
+
+        self.captured = 0 # キューに積んだフレーム数
+        self.dropped = 0  # バッファが空いておらず捨てたフレーム数
+        self.written = 0  # ファイルに書いたフレーム数
+
+        # 直近のフレーム (frame, 画面全体を圧縮したデータ)。差分ではないのでどこからでも書き出せる
+        self.replay = collections.deque(maxlen=replay_seconds * fps)
+        # save_replay() で頼まれた書き出し先
+        self.replay_requests = queue.Queue()
+
+        self.file = None
+        if path is not None:
+            self.file = open(path, "wb")
+            self.file.write(MAGIC + struct.pack(HEADER_FORMAT, width, height))
+        self.thread = threading.Thread(target=self._encode_loop, name="capture-encoder", daemon=True)
+        self.thread.start()
+
+    def capture_frame(self, frame):
+        """現在の画面をリングバッファにコピーしてエンコード待ちに積む (draw() の最後に呼ぶ)"""
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return
+        ctypes.memmove(self.ring_addresses[slot], pyxel.screen.data_ptr(), self.frame_size)
+        self.filled_slots.put_nowait((frame, slot))
+        self.captured += 1
+
+    def save_replay(self, path):
+        """直近のフレームを path に書き出すよう頼む (書き出しはエンコード用のスレッドで行うのですぐ戻る)"""
+        self.replay_requests.put(path)
+
+    def _encode_loop(self):
+        previous = bytearray(self.frame_size)
+        try:
+            while True:
+                try:
+                    item = self.filled_slots.get(timeout=0.1)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    frame, slot = item
+                    self._encode_frame(frame, slot, previous)
+                while not self.replay_requests.empty():
+                    self._write_replay(self.replay_requests.get())
+        finally:
+            if self.file is not None:
+                self._close_file()
+
+    def _encode_frame(self, frame, slot, previous):
+        current = self.ring[slot]
+        full = bytes(current)
+        delta = None
+        if self.file is not None and self.written % self.keyframe_interval != 0:
+            # 整数の XOR でまとめて差分を取る (1バイトずつループするより桁違いに速い)
+            delta = (int.from_bytes(current, "little") ^ int.from_bytes(previous, "little")).to_bytes(self.frame_size, "little")
+        previous[:] = current
+        # コピーし終わったのでバッファを返す (圧縮中もゲーム側は次のフレームを積める)
+        self.free_slots.put(slot)
+
+        compressed_full = zlib.compress(full, 1)
+        self.replay.append((frame, compressed_full))
+        if self.file is not None:
+            if delta is None:
+                flags, compressed = FLAG_KEYFRAME, compressed_full
+            else:
+                flags, compressed = 0, zlib.compress(delta, 1)
+            try:
+                self.file.write(struct.pack(FRAME_HEADER_FORMAT, frame, flags, len(compressed)))
+                self.file.write(compressed)
+            except OSError as e:
+                # ディスクがいっぱいなど。プレイ全体の録画はやめるが、直前のプレイの保存用の保持は続ける
+                print(f"capture stopped: {e}")
+                self._close_file(report=False)
+                return
+            self.written += 1
+
+    def _close_file(self, report=True):
+        file, self.file = self.file, None
+        try:
+            file.close()
+        except OSError as e:
+            # バッファに残っていた分を書き出せなかった
+            if report:
+                print(f"capture stopped: {e}")
+
+    def _write_replay(self, path):
+        frames = list(self.replay)
+        try:
+            with open(path, "wb") as f:
+                f.write(MAGIC + struct.pack(HEADER_FORMAT, self.width, self.height))
+                for frame, compressed in frames:
+                    f.write(struct.pack(FRAME_HEADER_FORMAT, frame, FLAG_KEYFRAME, len(compressed)))
+                    f.write(compressed)
+        except OSError as e:
+            # 書き込めない場所やディスクがいっぱいでも、エンコード用のスレッドは止めない
+            print(f"could not save replay: {e}")
+            return
+        print(f"saved replay: {path} ({len(frames)} frames)")
+
+    def close(self):
+        """残りのフレームと頼まれている直前のプレイを書き出してファイルを閉じる"""
+        if self.thread.is_alive():
+            try:
+                self.filled_slots.put(None, timeout=CLOSE_TIMEOUT)
+            except queue.Full:
+                pass
+            self.thread.join(CLOSE_TIMEOUT)
+        while not self.replay_requests.empty():
+            self._write_replay(self.replay_requests.get())
+
+
+def read_capture(path):
+    """録画ファイルを読み、(frame, 画面のバイト列) を順に返す"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a pinball capture file")
+        width, height = struct.unpack(HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+        frame_size = width * height
+        pixels = 0
+        while True:
+            header = f.read(FRAME_HEADER_SIZE)
+            if len(header) < FRAME_HEADER_SIZE:
+                break
+            frame, flags, length = struct.unpack(FRAME_HEADER_FORMAT, header)
+            data = int.from_bytes(zlib.decompress(f.read(length)), "little")
+            pixels = data if flags & FLAG_KEYFRAME else pixels ^ data
+            yield frame, pixels.to_bytes(frame_size, "little")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a pinball capture file")
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    count = 0
+    changed = 0
+    previous = None
+    for _frame, pixels in read_capture(args.path):
+        count += 1
+        if pixels != previous:
+            changed += 1
+        previous = pixels
+    print(f"frames={count} changed={changed}")
@@ -1,6 +1,12 @@
 import pyxel
 import math
 import random # random.uniformを使うためにインポート
+import argparse
+import array
+import atexit
+import hashlib
+import os
+import time # フレームの処理時間の計測用
 
 # Helper function for line-circle collision and response
 # 直線と円の衝突判定と応答のためのヘルパー関数
@@ -206,6 +212,255 @@ def collide_circle_circle(c1x, c1y, r1, c2x, c2y, r2, v1x, v1y, bounce_factor):
     return False, v1x, v1y, c1x, c1y # 衝突しない (速度も位置もそのまま返す)
 
 
+# 静的な台の形状 (壁、バンパーなど動かないもの) の符号付き距離場
+# 台の上にサブピクセルの格子を張り、各格子点から一番近い静的な物体の表面までの距離
+# (物体の内側は負) を事前に計算しておく。ボールの位置で双線形補間して半径より十分遠ければ
+# 静的な物体との衝突判定をまとめて省略できるので、判定の手間が物体の数によらなくなる。
+# 台の形状が同じなら計算結果をファイルにキャッシュして使い回す。
+class StaticDistanceField:
+    VERSION = 1 # 形式や計算方法を変えたら上げる (古いキャッシュを使わないように)
+
+    # 読み込み済みの距離場 (同じ台の Pinball を複数作っても共有する)
+    loaded = {}
+    # 作成中の距離場 (キャッシュのキー -> build_steps のジェネレータ)
+    # 同じ台の Pinball がいくつあっても1つだけ作り、どの Pinball からも同じものを進める
+    building = {}
+
+    def __init__(self, cols, rows, cell, values):
+        self.cols = cols     # 格子点の数 (X方向)
+        self.rows = rows     # 格子点の数 (Y方向)
+        self.cell = cell     # 格子の間隔 (ピクセル)
+        self.values = values # 距離 (array("f"), 行優先)
+        # 距離場は傾きが1以下なので、双線形補間の誤差は格子の対角線の長さより小さい
+        self.margin = cell * 1.5
+
+    @staticmethod
+    def grid_size(width, height, cell):
+        """格子点の数 (cols, rows)"""
+        return int(width / cell) + 1, int(height / cell) + 1
+
+    @classmethod
+    def cache_digest(cls, layout_key, width, height, cell):
+        """台の形状と格子から決まるキャッシュのキー"""
+        cols, rows = cls.grid_size(width, height, cell)
+        return hashlib.sha1(repr((cls.VERSION, cols, rows, cell, layout_key)).encode()).hexdigest()
+
+    @staticmethod
+    def cache_path(digest, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sdf_cache")
+        return os.path.join(cache_dir, f"{digest}.bin")
+
+    @classmethod
+    def build_steps(cls, width, height, cell, distance_func):
+        """distance_func(x, y) を全格子点で評価して距離場を作るジェネレータ
+
+        1行計算するごとに yield し、完成した距離場を StopIteration.value として返す
+        (ブラウザ版ではスレッドが使えないので、数フレームに分けて少しずつ作るため)
+        """
+        cols, rows = cls.grid_size(width, height, cell)
+        values = array.array("f", bytes(4 * cols * rows))
+        i = 0
+        for iy in range(rows):
+            y = iy * cell
+            for ix in range(cols):
+                values[i] = distance_func(ix * cell, y)
+                i += 1
+            yield
+        return cls(cols, rows, cell, values)
+
+    @classmethod
+    def start_build(cls, digest, width, height, cell, distance_func):
+        """digest の距離場の作成を始める (すでに作成中ならそれを使う)"""
+        if digest not in cls.building:
+            cls.building[digest] = cls.build_steps(width, height, cell, distance_func)
+
+    @classmethod
+    def continue_build(cls, digest, deadline=None):
+        """作成中の digest の距離場を time.perf_counter() が deadline になるまで進める
+
+        できあがっていれば距離場を、まだなら None を返す。deadline が None なら最後まで作る
+        """
+        field = cls.loaded.get(digest)
+        steps = cls.building.get(digest)
+        try:
+            while field is None and (deadline is None or time.perf_counter() < deadline):
+                next(steps)
+        except StopIteration as done:
+            field = done.value
+            cls.store(digest, field)
+        if field is not None:
+            cls.building.pop(digest, None)
+        return field
+
+    @classmethod
+    def load_cached(cls, digest, width, height, cell, cache_dir=None):
+        """読み込み済み、またはキャッシュファイルにある距離場を返す。なければ None"""
+        if digest in cls.loaded:
+            return cls.loaded[digest]
+        cols, rows = cls.grid_size(width, height, cell)
+        try:
+            with open(cls.cache_path(digest, cache_dir), "rb") as f:
+                values = array.array("f")
+                values.frombytes(f.read())
+        except (OSError, ValueError):
+            return None # キャッシュがない、または壊れている
+        if len(values) != cols * rows:
+            return None
+        cls.loaded[digest] = cls(cols, rows, cell, values)
+        return cls.loaded[digest]
+
+    @classmethod
+    def store(cls, digest, field, cache_dir=None):
+        """作った距離場を読み込み済みにし、キャッシュファイルにも保存する"""
+        cls.loaded[digest] = field
+        path = cls.cache_path(digest, cache_dir)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                field.values.tofile(f)
+        except OSError:
+            pass # 書き込めない環境では次回も作り直す
+
+    def distance(self, x, y):
+        """(x, y) から静的な物体までの距離 (双線形補間)。格子の外なら None"""
+        gx = x / self.cell
+        gy = y / self.cell
+        if gx < 0.0 or gy < 0.0 or gx >= self.cols - 1 or gy >= self.rows - 1:
+            return None
+        ix = int(gx)
+        iy = int(gy)
+        fx = gx - ix
+        fy = gy - iy
+        v = self.values
+        i = iy * self.cols + ix
+        top = v[i] + (v[i + 1] - v[i]) * fx
+        bottom = v[i + self.cols] + (v[i + self.cols + 1] - v[i + self.cols]) * fx
+        return top + (bottom - top) * fy
+
+    def near(self, x, y, radius):
+        """半径 radius の円が静的な物体に触れている可能性があるか"""
+        d = self.distance(x, y)
+        return d is None or d <= radius + self.margin
+
+
+# 論理ボタン名 (Pinball.read_input() が返す辞書のキー)
+INPUT_NAMES = ("flipper_l", "flipper_r", "plunger", "left", "right", "retry", "replay")
+
+# フレーム中に起きたイベント (Pinball.frame_events のビットフラグ)
+# 下位ビットはバンパー: バンパー i に当たったら 1 << i が立つ
+EVENT_MAX_BUMPERS = 14 # イベントのビットを持てるバンパーの数 (EVENT_LAUNCH より下のビット)
+EVENT_LAUNCH = 1 << 14 # プランジャーで発射した
+EVENT_DRAIN = 1 << 15  # ボールがアウトレーンに落ちた
+
+# 処理の重い端末でもフレームレートを保つための品質調整
+# 直近のフレームの処理時間 (前回の draw 以降に呼ばれたすべての update と今回の draw の合計) を測り、
+# 予算を超えていれば品質を1段階下げ、十分な余裕が続いたら1段階戻す
+# (処理が間に合わないと pyxel は draw を飛ばして update を続けて呼ぶので、update は全部数える)
+#   レベル 0: 通常品質
+#   レベル 1: ボールが遅い/フリッパーから遠いときはサブステップを減らす
+#   レベル 2: さらにサブステップを減らし (1サブステップで進む距離を伸ばす)、バンパーの光る演出を省く
+#   レベル 3: さらにサブステップを減らし、操作説明のテキストを省く
+class QualityGovernor:
+    def __init__(self, fps=30):
+        self.frame_budget = 1.0 / fps # 1フレームに使える時間 (秒)
+        self.level = 0
+        self.max_level = 3
+
+        # 1サブステップでボールが進んでよい距離 (ピクセル) - レベルごと (レベル0は固定サブステップ)
+        self.max_travel_per_step = (None, 1.0, 1.5, 2.0)
+        self.min_sub_steps = 2
+
+        # 判定に使う直近のフレーム数と閾値 (予算に対する割合)
+        self.window = 30
+        self.degrade_ratio = 0.9  # 平均がこれを超えたら品質を下げる
+        self.restore_ratio = 0.5  # 平均がこれを下回る状態が続いたら品質を戻す
+        # ヒステリシス: 品質を戻すには余裕が長く続く必要がある。変更直後はしばらく判定しない
+        self.restore_frames = 90
+        self.cooldown_frames = 30
+
+        self.frame_times = []
+        self.section_start = None # 計測中の update / draw の開始時刻
+        self.pending_time = 0.0   # 前回の draw 以降の update の処理時間の合計
+        self.headroom_frames = 0
+        self.cooldown = 0
+
+        # 品質が変わった回数 (どのくらいの頻度で端末が品質を落としているかの確認用)
+        self.downgrades = 0
+        self.upgrades = 0
+
+    def begin_section(self):
+        """update と draw の最初に呼ぶ"""
+        self.section_start = time.perf_counter()
+
+    def end_update(self):
+        """update の最後に呼ぶ。次の draw までの update の処理時間に加える"""
+        if self.section_start is None:
+            return
+        self.pending_time += time.perf_counter() - self.section_start
+        self.section_start = None
+
+    def end_frame(self):
+        """draw の最後に呼ぶ。処理時間を記録して必要なら品質レベルを変える"""
+        if self.section_start is None:
+            return
+        self.frame_times.append(self.pending_time + time.perf_counter() - self.section_start)
+        self.section_start = None
+        self.pending_time = 0.0
+        if len(self.frame_times) > self.window:
+            self.frame_times.pop(0)
+
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return
+        if len(self.frame_times) < self.window:
+            return
+
+        average = sum(self.frame_times) / len(self.frame_times)
+        if average > self.frame_budget * self.degrade_ratio:
+            self.headroom_frames = 0
+            if self.level < self.max_level:
+                self.set_level(self.level + 1, average)
+        elif average < self.frame_budget * self.restore_ratio:
+            self.headroom_frames += 1
+            if self.headroom_frames >= self.restore_frames and self.level > 0:
+                self.set_level(self.level - 1, average)
+        else:
+            self.headroom_frames = 0
+
+    def set_level(self, level, average):
+        """品質レベルを変えてログに残す"""
+        if level > self.level:
+            self.downgrades += 1
+        else:
+            self.upgrades += 1
+        print(f"[quality] level {self.level} -> {level} (avg frame {average * 1000:.1f}ms, budget {self.frame_budget * 1000:.1f}ms, down={self.downgrades} up={self.upgrades})")
+        self.level = level
+        self.frame_times.clear()
+        self.headroom_frames = 0
+        self.cooldown = self.cooldown_frames
+
+    def physics_sub_steps(self, game):
+        """このフレームで使うサブステップ数"""
+        max_travel = self.max_travel_per_step[self.level]
+        if max_travel is None:
+            return game.sub_steps
+        # フリッパーの近くでは貫通しやすいので常に通常品質
+        flipper_top_y = game.flipper_l_pivot_y - game.flipper_len * 0.5 - game.flipper_width
+        if game.ball_y + game.ball_r > flipper_top_y:
+            return game.sub_steps
+        speed = math.sqrt(game.ball_vx**2 + game.ball_vy**2)
+        return max(self.min_sub_steps, min(game.sub_steps, math.ceil(speed / max_travel)))
+
+    def bumper_flash(self):
+        """バンパーの光る演出を描くか"""
+        return self.level < 2
+
+    def hint_text(self):
+        """操作説明のテキストを描くか"""
+        return self.level < 3
+
+
 class Pinball:
     def __init__(self):
         # --- ウィンドウ設定 (initはメインガードで呼ぶ) ---
@@ -285,6 +540,14 @@ class Pinball:
 
         # --- 簡易的な貫通対策用の設定 ---
         self.sub_steps = 10 # 物理計算のサブステップ数（フレームを分割して計算する回数）
+        self.current_sub_steps = self.sub_steps # このフレームで実際に使うサブステップ数 (品質調整で減ることがある)
+
+        # --- 品質調整 (None なら常に通常品質) ---
+        self.governor = None
+
+        # --- 録画 ---
+        self.capture = None          # capture.FrameCapture (None なら録画しない)
+        self.instant_replay = False  # True なら replay ボタンで直近の数秒を保存する
 
         # --- バンパーの状態 ---
         # バンパーのリスト: {"cx": float, "cy": float, "r": float, "score": int, "hit_timer": int}
@@ -301,10 +564,71 @@ class Pinball:
         self.bumper_color_hit = 9     # ヒット時のバンパーの色 (茶色)
         self.bumper_bounce_factor = 5.0 # 例として5.0に設定（調整してください）
 
+        # --- 静的な物体の距離場 ---
+        self.static_field_cell = 0.5 # 格子の間隔 (ピクセル)
+        # キャッシュがなければ毎フレーム少しずつ作る。1フレームで作るのに使う時間 (秒)
+        self.static_field_build_budget = 0.002
+        self.static_field = None
+        self.static_field_build = None # 作成中なら StaticDistanceField.building のキー
+        self.build_static_field()
+
+        # --- 入力の状態 ---
+        # 論理ボタン名 -> 押されているか (bool)
+        # 通常は read_input() で pyxel から読み込むが、ヘッドレス実行 (server.py) では update(inputs) で外から渡す
+        self.input_held = {name: False for name in INPUT_NAMES} # 今フレームの入力
+        self.input_prev = dict(self.input_held)                 # 前フレームの入力 (押した瞬間/離した瞬間の判定用)
+
+        # --- フレームごとの記録 ---
+        self.frame_events = 0     # このフレームで起きたイベント (EVENT_* のビットフラグ)
+        self.frame_listeners = [] # update() の最後に listener(game) として呼ばれる (軌跡の記録など)
+
 
         # ゲームを初期状態にリセット
         self.reset_game()
 
+    def static_distance(self, x, y):
+        """(x, y) から一番近い静的な物体 (壁とバンパー) の表面までの距離。内側は負"""
+        # 壁 (左、右、上) - 下はアウトレーンなので物体ではない
+        d = min(x - self.wall_thickness, self.WIDTH - self.wall_thickness - x, y - self.wall_thickness)
+        for bumper in self.bumpers:
+            d = min(d, math.sqrt((x - bumper["cx"])**2 + (y - bumper["cy"])**2) - bumper["r"])
+        return d
+
+    def build_static_field(self, incremental=True):
+        """静的な物体の距離場を作る (壁やバンパーの配置を変えたら呼び直す)
+
+        キャッシュがなく incremental が True なら、update() のたびに少しずつ作る。
+        できあがるまでは距離場なしで、すべての静的な物体と判定する。
+        多数の Pinball を動かすヘッドレス実行では incremental=False で最初に一度作っておく。
+        """
+        # バンパーごとのイベントのビット (frame_events) が足りなくならないように
+        assert len(self.bumpers) <= EVENT_MAX_BUMPERS, f"at most {EVENT_MAX_BUMPERS} bumpers are supported"
+        layout_key = (
+            self.WIDTH, self.HEIGHT, self.wall_thickness,
+            tuple((bumper["cx"], bumper["cy"], bumper["r"]) for bumper in self.bumpers),
+        )
+        digest = StaticDistanceField.cache_digest(layout_key, self.WIDTH, self.HEIGHT, self.static_field_cell)
+        self.static_field = StaticDistanceField.load_cached(digest, self.WIDTH, self.HEIGHT, self.static_field_cell)
+        self.static_field_build = None
+        if self.static_field is not None:
+            return
+        StaticDistanceField.start_build(digest, self.WIDTH, self.HEIGHT, self.static_field_cell, self.static_distance)
+        if incremental:
+            self.static_field_build = digest
+        else:
+            self.static_field = StaticDistanceField.continue_build(digest)
+
+    def continue_static_field_build(self):
+        """作成中の距離場を static_field_build_budget 秒分だけ進める
+
+        同じ台の Pinball はすべて同じ作成中の距離場を進めるので、別の Pinball が作り終えていればそれを使う
+        """
+        deadline = time.perf_counter() + self.static_field_build_budget
+        field = StaticDistanceField.continue_build(self.static_field_build, deadline)
+        if field is not None:
+            self.static_field = field
+            self.static_field_build = None
+
     # --- reset_game メソッドは Pinball クラスのメソッドとして定義されているはずです ---
     def reset_game(self):
         """ゲームの状態を初期値にリセットする"""
@@ -336,14 +660,73 @@ class Pinball:
         self.ball_vy = 0.0
 
 
-    def update(self):
-        """ゲームの状態を毎フレーム更新する"""
+    def read_input(self):
+        """pyxel のキー/ゲームパッドの状態を論理ボタンの辞書として読み込む"""
+        return {
+            # 左フリッパー (Zキー または ゲームパッドXボタン)
+            "flipper_l": pyxel.btn(pyxel.KEY_Z) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_LEFT),
+            # 右フリッパー (SLASHキー または ゲームパッドBボタン)
+            "flipper_r": pyxel.btn(pyxel.KEY_SLASH) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_B),
+            # プランジャー (スペースキー または ゲームパッドYボタン)
+            "plunger": pyxel.btn(pyxel.KEY_SPACE) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_Y),
+            # 発射方向 (左右キー または ゲームパッドの左右方向)
+            "left": pyxel.btn(pyxel.KEY_LEFT) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_LEFT),
+            "right": pyxel.btn(pyxel.KEY_RIGHT) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_RIGHT),
+            # リトライ (Rキー または ゲームパッドAボタン)
+            "retry": pyxel.btn(pyxel.KEY_R) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_A),
+            # 直前のプレイを保存 (Cキー)
+            "replay": pyxel.btn(pyxel.KEY_C),
+        }
+
+    def btn(self, name):
+        """論理ボタンが押されているか"""
+        return self.input_held.get(name, False)
+
+    def btnp(self, name):
+        """論理ボタンがこのフレームで押されたか"""
+        return self.input_held.get(name, False) and not self.input_prev.get(name, False)
+
+    def btnr(self, name):
+        """論理ボタンがこのフレームで離されたか"""
+        return self.input_prev.get(name, False) and not self.input_held.get(name, False)
+
+    def is_idle(self):
+        """入力待ちで止まっている状態か (update を飛ばしても見た目が変わらない状態か)"""
+        # READY / GAME_OVER で何も押されておらず、フリッパーもバンパー演出も止まっている
+        if self.game_state == "PLAYING" or self.plunger_pull_time > 0:
+            return False
+        if any(self.input_held.values()):
+            return False
+        if self.flipper_angle_l_deg != self.flipper_angle_min_deg or self.flipper_angle_r_deg != self.flipper_angle_min_deg:
+            return False
+        return all(bumper["hit_timer"] == 0 for bumper in self.bumpers)
+
+
+    def update(self, inputs=None):
+        """ゲームの状態を毎フレーム更新する
+
+        inputs を省略した場合は pyxel から入力を読む。ヘッドレス実行では論理ボタンの辞書を渡す。
+        """
+        if self.governor is not None:
+            self.governor.begin_section()
+
+        if self.static_field_build is not None:
+            self.continue_static_field_build()
+
         self.game_timer += 1 # ゲームタイマーを進める
+        self.frame_events = 0
+
+        # --- 入力の更新 ---
+        self.input_prev = self.input_held
+        if inputs is None:
+            self.input_held = self.read_input()
+        else:
+            self.input_held = {name: bool(inputs.get(name, False)) for name in INPUT_NAMES}
 
         # --- フリッパーの角度更新 (キー入力に基づいて毎フレーム行う) ---
-        # 左フリッパー (Zキー または ゲームパッドXボタン)
+        # 左フリッパー
         target_angle_l = self.flipper_angle_min_deg
-        if pyxel.btn(pyxel.KEY_Z) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_LEFT):
+        if self.btn("flipper_l"):
             target_angle_l = self.flipper_angle_max_deg
 
         # 角度を滑らかに変化させる
@@ -353,9 +736,9 @@ class Pinball:
              self.flipper_angle_l_deg = max(self.flipper_angle_l_deg - self.flipper_speed_deg, target_angle_l)
 
 
-        # 右フリッパー (SLASHキー または ゲームパッドBボタン)
+        # 右フリッパー
         target_angle_r = self.flipper_angle_min_deg
-        if pyxel.btn(pyxel.KEY_SLASH) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_B):
+        if self.btn("flipper_r"):
              target_angle_r = self.flipper_angle_max_deg
 
         # 角度を滑らかに変化させる
@@ -380,21 +763,38 @@ class Pinball:
             self.update_ready()
         elif self.game_state == "PLAYING":
             # 物理計算を複数のサブステップに分割して実行
-            for _ in range(self.sub_steps):
+            self.current_sub_steps = self.sub_steps if self.governor is None else self.governor.physics_sub_steps(self)
+            for _ in range(self.current_sub_steps):
                  # update_physics内でボールアウトするとREADY状態になるため、
                  # READY状態になったらループを中断するチェックを追加
                  if self.game_state != "PLAYING":
                       break # ボールアウトしたらサブステップを中断
-                 self.update_physics(1.0 / self.sub_steps) # 1フレームの時間 (1.0) をサブステップ数で割った時間
+                 self.update_physics(1.0 / self.current_sub_steps) # 1フレームの時間 (1.0) をサブステップ数で割った時間
 
 
         elif self.game_state == "GAME_OVER":
              self.update_game_over()
 
-        # どこでも共通のリトライ処理 (Rキー または ゲームパッドAボタン)
-        if self.game_state == "GAME_OVER" and (pyxel.btnp(pyxel.KEY_R) or pyxel.btnp(pyxel.GAMEPAD1_BUTTON_A)):
+        # どこでも共通のリトライ処理
+        if self.game_state == "GAME_OVER" and self.btnp("retry"):
             self.reset_game()
 
+        # 直前のプレイを保存
+        if self.instant_replay and self.btnp("replay"):
+            if self.capture is not None:
+                # 録画用のスレッドが書き出すので、プレイ中でもゲームは止まらない
+                self.capture.save_replay(time.strftime("replay_%Y%m%d_%H%M%S.pbcap"))
+            elif self.game_state != "PLAYING":
+                # capture.py を使えない環境 (ブラウザ版) では pyxel の画面録画 (capture_sec) をGIFにする
+                # GIFの書き出しはその場で行われてフレームが止まるので、プレイ中は受け付けない
+                pyxel.screencast()
+
+        for listener in self.frame_listeners:
+            listener(self)
+
+        if self.governor is not None:
+            self.governor.end_update()
+
     def update_physics(self, dt):
         """物理計算と衝突判定を分割された時間 dt で実行"""
 
@@ -425,25 +825,29 @@ class Pinball:
 
 
         # --- 衝突判定と応答 ---
+        # 距離場で壁やバンパーから十分離れているとわかれば、静的な物体との判定はすべて省略する
+        near_static = self.static_field is None or self.static_field.near(self.ball_x, self.ball_y, self.ball_r)
+
         # 壁との衝突 (ボールの位置がめり込んでいたら調整)
         # ササブステップごとに判定・調整
-        # 左壁
-        if self.ball_x - self.ball_r < self.wall_thickness:
-            self.ball_x = self.wall_thickness + self.ball_r # 壁の境界まで位置を戻す
-            self.ball_vx *= -self.bounce_factor # X速度を反転・減衰
-            # print(f"Wall L Collision! New pos=({self.ball_x:.2f}, {self.ball_y:.2f}) v=({self.ball_vx:.2f}, {self.ball_vy:.2f})")
-
-        # 右壁
-        if self.ball_x + self.ball_r > self.WIDTH - self.wall_thickness:
-            self.ball_x = self.WIDTH - self.wall_thickness - self.ball_r
-            self.ball_vx *= -self.bounce_factor
-            # print(f"Wall R Collision! New pos=({self.ball_x:.2f}, {self.ball_y:.2f}) v=({self.ball_vx:.2f}, {self.ball_vy:.2f})")
-
-        # 上壁
-        if self.ball_y - self.ball_r < self.wall_thickness:
-             self.ball_y = self.wall_thickness + self.ball_r
-             self.ball_vy *= -self.bounce_factor
-             # print(f"Wall U Collision! New pos=({self.ball_x:.2f}, {self.ball_y:.2f}) v=({self.ball_vx:.2f}, {self.ball_vy:.2f})")
+        if near_static:
+            # 左壁
+            if self.ball_x - self.ball_r < self.wall_thickness:
+                self.ball_x = self.wall_thickness + self.ball_r # 壁の境界まで位置を戻す
+                self.ball_vx *= -self.bounce_factor # X速度を反転・減衰
+                # print(f"Wall L Collision! New pos=({self.ball_x:.2f}, {self.ball_y:.2f}) v=({self.ball_vx:.2f}, {self.ball_vy:.2f})")
+
+            # 右壁
+            if self.ball_x + self.ball_r > self.WIDTH - self.wall_thickness:
+                self.ball_x = self.WIDTH - self.wall_thickness - self.ball_r
+                self.ball_vx *= -self.bounce_factor
+                # print(f"Wall R Collision! New pos=({self.ball_x:.2f}, {self.ball_y:.2f}) v=({self.ball_vx:.2f}, {self.ball_vy:.2f})")
+
+            # 上壁
+            if self.ball_y - self.ball_r < self.wall_thickness:
+                 self.ball_y = self.wall_thickness + self.ball_r
+                 self.ball_vy *= -self.bounce_factor
+                 # print(f"Wall U Collision! New pos=({self.ball_x:.2f}, {self.ball_y:.2f}) v=({self.ball_vx:.2f}, {self.ball_vy:.2f})")
 
 
         # 下壁 (アウトレーン)
@@ -465,10 +869,10 @@ class Pinball:
 
         # サブステップごとの角速度 (ラジアン/サブステップ)
         # 左フリッパー: 物理的な角速度 = Pyxel基準角度変化量 * (-1) / sub_steps
-        angular_velocity_l_physical_dt = math.radians(-angular_change_l_deg_frame) / self.sub_steps
+        angular_velocity_l_physical_dt = math.radians(-angular_change_l_deg_frame) / self.current_sub_steps
 
         # 右フリッパー: 物理的な角速度 = -(Pyxel基準角度変化量) / sub_steps
-        angular_velocity_r_physical_dt = math.radians(-angular_change_r_deg_frame) / self.sub_steps
+        angular_velocity_r_physical_dt = math.radians(-angular_change_r_deg_frame) / self.current_sub_steps
 
 
         # 左フリッパーとの衝突判定 (当たり判定は中心線分に対して行う)
@@ -488,6 +892,7 @@ class Pinball:
         fl_tip_y = self.flipper_l_pivot_y + self.flipper_len * math.sin(angle_l_rad_pyxel_current)
 
 
+        collided_r = False
         collided_l, self.ball_vx, self.ball_vy, self.ball_x, self.ball_y = collide_line_circle(
             self.flipper_l_pivot_x, self.flipper_l_pivot_y,
             fl_tip_x, fl_tip_y, # フリッパー先端座標 (現在の角度)
@@ -529,7 +934,9 @@ class Pinball:
         # --- バンパーとの衝突判定 ---
         # バンパーもサブステップごとに判定・処理
         # フリッパーとの衝突でボールの位置や速度が変わっている可能性があるので、最新の値を使う
-        for bumper in self.bumpers:
+        if (collided_l or collided_r) and self.static_field is not None:
+            near_static = self.static_field.near(self.ball_x, self.ball_y, self.ball_r)
+        for bumper_index, bumper in enumerate(self.bumpers if near_static else ()):
              # collide_circle_circle は位置と速度を更新したタプルを返す
              collided_bumper, new_vx_bumper, new_vy_bumper, temp_x, temp_y = collide_circle_circle( # 新しい速度も受け取る
                  self.ball_x, self.ball_y, self.ball_r, # ボールの情報 (位置は衝突で変わっている可能性があるので最新を使う)
@@ -564,6 +971,7 @@ class Pinball:
                  self.score += bumper["score"]
                  # バンパーのヒット演出タイマーを設定
                  bumper["hit_timer"] = self.bumper_hit_duration
+                 self.frame_events |= 1 << bumper_index
                  # バンパーのヒット音を鳴らす (TODO)
                  # pyxel.play(0, 0) # サウンド番号などを指定
 
@@ -576,21 +984,21 @@ class Pinball:
     def update_ready(self):
         """ゲーム開始前の待機状態（プランジャー操作）の更新処理"""
 
-        # プランジャー操作 (スペースキー または ゲームパッドYボタン)
-        if pyxel.btn(pyxel.KEY_SPACE) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_Y):
+        # プランジャー操作
+        if self.btn("plunger"):
             max_pull_frames = int(self.max_plunger_force / self.plunger_force_scale) + 30
             self.plunger_pull_time = min(self.plunger_pull_time + 1, max_pull_frames)
 
-        # プランジャーを離した瞬間 (スペースキー または ゲームパッドYボタン)
-        elif pyxel.btnr(pyxel.KEY_SPACE) or pyxel.btnr(pyxel.GAMEPAD1_BUTTON_Y):
+        # プランジャーを離した瞬間
+        elif self.btnr("plunger"):
             # 引いていた時間に応じて基本的な速度（縦方向）を計算
             base_plunger_force = min(self.plunger_pull_time * self.plunger_force_scale, self.max_plunger_force)
 
             if self.plunger_pull_time > 0:
                  # 発射時の速度を斜めにする
                  # 左右キー または ゲームパッドの左右方向入力をチェック
-                 move_left = pyxel.btn(pyxel.KEY_LEFT) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_LEFT)
-                 move_right = pyxel.btn(pyxel.KEY_RIGHT) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_RIGHT)
+                 move_left = self.btn("left")
+                 move_right = self.btn("right")
 
                  if move_left and not move_right: # 左キーが押されている
                      self.ball_vx = -base_plunger_force * self.plunger_side_force_scale # 左方向速度
@@ -619,6 +1027,7 @@ class Pinball:
                      self.ball_vy = -base_plunger_force # 真上方向速度 (負の値で上向き)
 
                  self.game_state = "PLAYING"
+                 self.frame_events |= EVENT_LAUNCH
 
             self.plunger_pull_time = 0
 
@@ -636,6 +1045,7 @@ class Pinball:
     def lose_ball(self):
         """ボールを失う処理"""
         self.balls -= 1
+        self.frame_events |= EVENT_DRAIN
         if self.balls <= 0:
             self.game_state = "GAME_OVER"
             self.game_timer = 0
@@ -647,6 +1057,9 @@ class Pinball:
 
     def draw(self):
         """ゲーム画面を毎フレーム描画する"""
+        if self.governor is not None:
+            self.governor.begin_section()
+
         pyxel.cls(0)
 
         # --- テーブルの壁を描画 ---
@@ -753,9 +1166,10 @@ class Pinball:
         pyxel.circ(int(self.flipper_r_pivot_x), int(self.flipper_r_pivot_y), pivot_circle_r, flipper_color)
 
         # --- バンパーを描画 ---
+        bumper_flash = self.governor is None or self.governor.bumper_flash()
         for bumper in self.bumpers:
-            # ヒットしている場合は色を変える
-            color = self.bumper_color_hit if bumper["hit_timer"] > 0 else self.bumper_color_normal
+            # ヒットしている場合は色を変える (品質を下げている間は光らせない)
+            color = self.bumper_color_hit if bumper_flash and bumper["hit_timer"] > 0 else self.bumper_color_normal
             # 円として描画 (中心x, 中心y, 半径, 色)
             pyxel.circ(int(bumper["cx"]), int(bumper["cy"]), int(bumper["r"]), color)
 
@@ -769,7 +1183,9 @@ class Pinball:
         pyxel.text(self.wall_thickness + 5, self.wall_thickness + 5, f"SCORE: {self.score}", 7)
         pyxel.text(self.wall_thickness + 5, self.wall_thickness + 15, f"BALLS: {self.balls}", 7)
 
-        if self.game_state == "READY":
+        hint_text = self.governor is None or self.governor.hint_text()
+
+        if self.game_state == "READY" and hint_text:
              launch_text = "PRESS SPACE TO LAUNCH"
              launch_text_width = len(launch_text) * 4
              pyxel.text(self.WIDTH//2 - launch_text_width // 2, self.HEIGHT - 60, launch_text, 7)
@@ -779,15 +1195,51 @@ class Pinball:
             game_over_width = len(game_over_text) * 4
             pyxel.text(self.WIDTH//2 - game_over_width // 2, self.HEIGHT//2, game_over_text, 8)
 
-            retry_text = "PRESS R TO RETRY"
-            retry_width = len(retry_text) * 4
-            pyxel.text(self.WIDTH//2 - retry_width // 2, self.HEIGHT//2 + 10, retry_text, 7)
+            if hint_text:
+                retry_text = "PRESS R TO RETRY"
+                retry_width = len(retry_text) * 4
+                pyxel.text(self.WIDTH//2 - retry_width // 2, self.HEIGHT//2 + 10, retry_text, 7)
+
+        if self.capture is not None:
+            self.capture.capture_frame(pyxel.frame_count)
+
+        if self.governor is not None:
+            self.governor.end_frame()
 
 
+# 直前のプレイとして保存する秒数 (描画した画面をこの秒数分メモリに保持する)
+REPLAY_SECONDS = 10
+
 # --- ゲームの開始 ---
 if __name__ == "__main__":
-    pyxel.init(160, 240)
+    parser = argparse.ArgumentParser(prog="main.py", description="Pinball")
+    parser.add_argument("--capture", metavar="PATH", help="record the whole session to this capture file")
+    # 外部ツール向けに状態を共有メモリへ公開する (名前を省略すると state_export.DEFAULT_NAME)
+    parser.add_argument("--export-state", nargs="?", const="", metavar="NAME", help="publish the game state to shared memory")
+    args = parser.parse_args()
+
+    # 録画は capture.py で行う。読み込めない環境 (ブラウザ版) では pyxel の画面録画を使う
+    try:
+        from capture import FrameCapture
+    except ImportError:
+        FrameCapture = None
+
+    pyxel.init(160, 240, capture_sec=0 if FrameCapture is not None else REPLAY_SECONDS)
 
     game = Pinball()
+    game.governor = QualityGovernor()
+    game.instant_replay = True
+
+    if FrameCapture is not None:
+        # --capture を指定するとプレイ全体も録画する
+        game.capture = FrameCapture(args.capture, game.WIDTH, game.HEIGHT, replay_seconds=REPLAY_SECONDS)
+        atexit.register(game.capture.close)
+
+    if args.export_state is not None:
+        from state_export import DEFAULT_NAME, StatePublisher
+
+        publisher = StatePublisher(args.export_state or DEFAULT_NAME)
+        game.frame_listeners.append(publisher.publish)
+        atexit.register(publisher.close)
 
     pyxel.run(game.update, game.draw)
\ No newline at end of file
@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import time
+from collections import deque
+
+from main import INPUT_NAMES, Pinball
+
+# 複数の Pinball セッションを1プロセスで動かすヘッドレスのゲームサーバー
+#
+# クライアントはローカルのTCPソケットに1行1コマンドのテキストで接続する:
+#   NEW                      -> 新しいセッションを作成し "OK <session_id>" を返す
+#   INPUT <session_id> <btn> -> 押されているボタンをカンマ区切りで送る (何も押していなければ "-")
+#                               例: "INPUT 3 flipper_l,flipper_r"
+#   STATE <session_id>       -> "OK <game_state> <score> <balls>" を返す
+#   CLOSE <session_id>       -> セッションを破棄する
+#   STATS                    -> ティック処理時間のパーセンタイルを稼働セッション数の区切りごとに返す
+# 接続が切れると、その接続で NEW したセッションはすべて破棄される。
+#
+# 全セッションは共通の固定レートのティックでまとめて update() される。
+# READY / GAME_OVER で入力のないセッション (Pinball.is_idle()) は駐車して処理を飛ばす。
+#
+# --workers N は起動時に N 個のプロセスを port, port+1, ... で立てるだけで、
+# セッションの振り分けや移動はしない (クライアント側でポートを選ぶ)。
+# ティックが間隔に収まらないことが続くと、ワーカーを増やすよう警告を出す。
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_TICK_RATE = 30 # pyxel のデフォルトFPSに合わせる
+
+
+class SessionManager:
+    def __init__(self, tick_rate=DEFAULT_TICK_RATE, latency_window=300, bucket_size=50):
+        self.tick_rate = tick_rate
+        self.tick_interval = 1.0 / tick_rate
+
+        # session_id -> Pinball
+        self.sessions = {}
+        # session_id -> 現在押されているボタンの辞書 (クライアントが次に送ってくるまで保持)
+        self.inputs = {}
+        # 入力が届くまで update を飛ばすセッション
+        self.parked = set()
+        self._next_id = itertools.count(1)
+
+        # 直近のティックの (稼働セッション数, 処理時間 (秒))
+        self.tick_samples = deque(maxlen=latency_window)
+        self.tick_count = 0
+        self.overruns = 0 # ティック間隔に収まらなかった回数
+        # パーセンタイルを集計するときの稼働セッション数の区切り幅
+        self.bucket_size = bucket_size
+        # 直近のティックのうちこの割合以上が間隔に収まらなければ1コアでは足りないと判断する
+        self.saturation_ratio = 0.1
+
+    def create_session(self):
+        """新しいセッションを作成してIDを返す"""
+        session_id = next(self._next_id)
+        game = Pinball()
+        # 距離場のキャッシュがなければここで一度だけ作る (ティックの中で少しずつ作るとティックが遅れる)
+        game.build_static_field(incremental=False)
+        self.sessions[session_id] = game
+        self.inputs[session_id] = {name: False for name in INPUT_NAMES}
+        return session_id
+
+    def close_session(self, session_id):
+        """セッションを破棄する"""
+        self.sessions.pop(session_id, None)
+        self.inputs.pop(session_id, None)
+        self.parked.discard(session_id)
+
+    def set_input(self, session_id, held):
+        """クライアントから届いた入力を保存し、駐車中なら起こす"""
+        if session_id not in self.sessions:
+            raise KeyError(session_id)
+        unknown = set(held) - set(INPUT_NAMES)
+        if unknown:
+            raise ValueError(f"unknown buttons: {','.join(sorted(unknown))}")
+        self.inputs[session_id] = {name: name in held for name in INPUT_NAMES}
+        self.parked.discard(session_id)
+
+    def tick(self):
+        """駐車していない全セッションを1フレーム進める"""
+        start = time.perf_counter()
+        active = 0
+        for session_id, game in self.sessions.items():
+            if session_id in self.parked:
+                continue
+            game.update(self.inputs[session_id])
+            active += 1
+            if game.is_idle():
+                self.parked.add(session_id)
+        elapsed = time.perf_counter() - start
+
+        self.tick_samples.append((active, elapsed))
+        self.tick_count += 1
+        if elapsed > self.tick_interval:
+            self.overruns += 1
+        return elapsed
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """直近のティック処理時間のパーセンタイル (ミリ秒) を稼働セッション数の区切りごとに返す
+
+        buckets のキーは稼働セッション数の区切りの下限 (bucket_size 刻み)
+        """
+        grouped = {}
+        for active, elapsed in self.tick_samples:
+            grouped.setdefault(active // self.bucket_size * self.bucket_size, []).append(elapsed)
+
+        buckets = {}
+        for lower in sorted(grouped):
+            samples = sorted(grouped[lower])
+            bucket = {"ticks": len(samples)}
+            for p in percentiles:
+                index = min(len(samples) - 1, int(len(samples) * p / 100))
+                bucket[f"p{p}_ms"] = samples[index] * 1000.0
+            buckets[lower] = bucket
+
+        return {
+            "sessions": len(self.sessions),
+            "ticks": self.tick_count,
+            "overruns": self.overruns,
+            "saturated": self.is_saturated(),
+            "buckets": buckets,
+        }
+
+    def is_saturated(self):
+        """直近のティックが間隔に収まらないことが多い (1コアでは足りない) か"""
+        if not self.tick_samples:
+            return False
+        late = sum(1 for _active, elapsed in self.tick_samples if elapsed > self.tick_interval)
+        return late >= len(self.tick_samples) * self.saturation_ratio
+
+    async def run(self, report_interval=10.0):
+        """固定レートでティックを回し続ける"""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        next_report = next_tick + report_interval
+        while True:
+            self.tick()
+            now = loop.time()
+            if report_interval and now >= next_report:
+                print(format_report(self.latency_percentiles()))
+                if self.is_saturated():
+                    # ワーカーは自動では増やさない。起動時の --workers で増やし、クライアントを別ポートに振り分ける
+                    print(f"warning: tick overruns on {len(self.sessions)} sessions; start more workers with --workers")
+                next_report = now + report_interval
+
+            next_tick += self.tick_interval
+            if next_tick < now:
+                # 処理が間に合わなかった場合は遅れを取り戻そうとせず、次のティックから仕切り直す
+                next_tick = now
+            await asyncio.sleep(next_tick - now)
+
+    async def handle_client(self, reader, writer):
+        """1クライアント分のコマンドを処理する。切断したらそのクライアントが作ったセッションを破棄する"""
+        owned = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write((self.handle_command(line, owned) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for session_id in owned:
+                self.close_session(session_id)
+            writer.close()
+
+    def handle_command(self, line, owned):
+        """コマンド1行を処理して応答文字列を返す。owned はこの接続が作ったセッションIDの集合"""
+        try:
+            args = line.decode().split()
+        except UnicodeDecodeError:
+            return "ERR invalid encoding"
+        if not args:
+            return "ERR empty command"
+        command = args[0].upper()
+        try:
+            if command == "NEW":
+                session_id = self.create_session()
+                owned.add(session_id)
+                return f"OK {session_id}"
+            if command == "INPUT":
+                session_id = int(args[1])
+                held = set() if len(args) < 3 or args[2] == "-" else set(args[2].split(","))
+                try:
+                    self.set_input(session_id, held)
+                except ValueError as e:
+                    return f"ERR {e}"
+                return "OK"
+            if command == "STATE":
+                game = self.sessions[int(args[1])]
+                return f"OK {game.game_state} {game.score} {game.balls}"
+            if command == "CLOSE":
+                session_id = int(args[1])
+                self.close_session(session_id)
+                owned.discard(session_id)
+                return "OK"
+            if command == "STATS":
+                return "OK " + format_report(self.latency_percentiles())
+        except (IndexError, ValueError):
+            return f"ERR bad arguments for {command}"
+        except KeyError:
+            return "ERR unknown session"
+        return f"ERR unknown command {command}"
+
+
+def format_report(report):
+    """latency_percentiles() の結果を1行の文字列にする"""
+    parts = [f"{key}={value}" for key, value in report.items() if key != "buckets"]
+    for lower, bucket in report["buckets"].items():
+        stats = ",".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in bucket.items())
+        parts.append(f"active>={lower}:{stats}")
+    return " ".join(parts)
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, tick_rate=DEFAULT_TICK_RATE):
+    """ソケットで入力を受け付けながらセッションを回す"""
+    manager = SessionManager(tick_rate)
+    server = await asyncio.start_server(manager.handle_client, host, port)
+    print(f"pinball server listening on {host}:{port} ({tick_rate} ticks/s)")
+    async with server:
+        await manager.run()
+
+
+def run_worker(host, port, tick_rate):
+    asyncio.run(serve(host, port, tick_rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless multi-session pinball server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--tick-rate", type=int, default=DEFAULT_TICK_RATE)
+    # 1コアで足りない場合はワーカープロセスを増やす (ワーカー i は port + i で待ち受ける)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        run_worker(args.host, args.port, args.tick_rate)
+    else:
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(args.host, args.port + i, args.tick_rate))
+            for i in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,257 @@
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+# 実行中の Pinball の状態を共有メモリに毎フレーム書き出し、別プロセスから読めるようにする
+# (配信オーバーレイ、外部のボット、録画ツールなど向け)
+#
+# 共有メモリのレイアウト (リトルエンディアン, 固定長):
+#   offset 0: seq (uint64) - シーケンスロックのカウンタ。書き込み中は奇数、書き終わると偶数
+#   offset 8: owner (uint32) - 書き込み側のプロセスID, パディング 4バイト
+#   offset 16: frame (uint32), game_state (uint8, STATE_CODES), balls (uint8), パディング 2バイト,
+#              score (int32), ball_x, ball_y, ball_vx, ball_vy, flipper_l_deg, flipper_r_deg (float32),
+#              published_at (float64, time.monotonic() の値)
+#
+# 書き込み側はロックもシステムコールも使わない。読み込み側は seq が書き込みの前後で
+# 変わっていないことを確認し、変わっていれば読み直す。
+
+DEFAULT_NAME = "pinball_state"
+READ_RETRIES = 10000     # 書き込み中の seq を読み直す上限 (書き込み側が書き込み途中で止まった場合に備える)
+POLL_INTERVAL = 0.001    # wait_for_frame で新しいフレームを待つ間隔 (秒)
+LIVENESS_CHECK = 0.2     # 書き込み側のプロセスIDが分からないとき、seq が進むか確かめる時間 (秒, 数フレーム分)
+
+SEQ_FORMAT = "<Q"
+OWNER_FORMAT = "<I4x"
+OWNER_OFFSET = struct.calcsize(SEQ_FORMAT)
+PAYLOAD_FORMAT = "<IBB2xi6fd"
+PAYLOAD_OFFSET = OWNER_OFFSET + struct.calcsize(OWNER_FORMAT)
+BLOCK_SIZE = PAYLOAD_OFFSET + struct.calcsize(PAYLOAD_FORMAT)
+
+STATE_CODES = {"READY": 0, "PLAYING": 1, "GAME_OVER": 2}
+STATE_NAMES = {code: name for name, code in STATE_CODES.items()}
+
+GameSnapshot = namedtuple(
+    "GameSnapshot",
+    "frame game_state balls score ball_x ball_y ball_vx ball_vy flipper_l_deg flipper_r_deg published_at",
+)
+
+
+class StatePublisher:
+    def __init__(self, name=DEFAULT_NAME):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=BLOCK_SIZE)
+        except FileExistsError:
+            # 前回異常終了して残っているブロックなら使い回す。別のゲームが使用中ならエラー
+            self.shm = claim_stale_block(name)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.seq = 0
+        self.frame = 0
+        struct.pack_into(SEQ_FORMAT, self.buf, 0, self.seq)
+        struct.pack_into(OWNER_FORMAT, self.buf, OWNER_OFFSET, os.getpid())
+
+    def publish(self, game):
+        """Pinball の現在の状態を書き出す (Pinball.frame_listeners に登録して使う)"""
+        self.seq += 1 # 奇数: 書き込み中
+        struct.pack_into(SEQ_FORMAT, self.buf, 0, self.seq)
+        struct.pack_into(
+            PAYLOAD_FORMAT, self.buf, PAYLOAD_OFFSET,
+            self.frame,
+            STATE_CODES[game.game_state], max(0, min(game.balls, 255)), game.score,
+            game.ball_x, game.ball_y, game.ball_vx, game.ball_vy,
+            game.flipper_angle_l_deg, game.flipper_angle_r_deg,
+            time.monotonic(),
+        )
+        self.seq += 1 # 偶数: 書き込み完了
+        struct.pack_into(SEQ_FORMAT, self.buf, 0, self.seq)
+        self.frame += 1
+
+    def close(self):
+        """共有メモリを閉じて削除する"""
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class StateReader:
+    def __init__(self, name=DEFAULT_NAME):
+        self.shm = attach(name)
+        self.buf = self.shm.buf
+
+    def read(self, retries=READ_RETRIES):
+        """一貫したスナップショットを返す。まだ1フレームも書かれていなければ None
+
+        retries 回読み直しても書き込みが終わらなければ TimeoutError (書き込み側が途中で止まった)
+        """
+        for _ in range(retries):
+            seq_before = struct.unpack_from(SEQ_FORMAT, self.buf, 0)[0]
+            if seq_before == 0:
+                return None
+            if seq_before & 1:
+                continue # 書き込み中
+            values = struct.unpack_from(PAYLOAD_FORMAT, self.buf, PAYLOAD_OFFSET)
+            if struct.unpack_from(SEQ_FORMAT, self.buf, 0)[0] == seq_before:
+                break
+        else:
+            raise TimeoutError("the publisher appears to have stopped in the middle of a write")
+        frame, state_code, balls, score, *rest = values
+        return GameSnapshot(frame, STATE_NAMES.get(state_code, "UNKNOWN"), balls, score, *rest)
+
+    def sequence(self):
+        """書き込みカウンタ。変わっていなければ新しいフレームはない"""
+        return struct.unpack_from(SEQ_FORMAT, self.buf, 0)[0]
+
+    def wait_for_frame(self, after_frame=-1, timeout=1.0, poll_interval=POLL_INTERVAL):
+        """frame が after_frame より新しいスナップショットが出るまで poll_interval ごとに確認して待つ"""
+        deadline = time.monotonic() + timeout
+        last_seq = None
+        while True:
+            seq = self.sequence()
+            if seq != last_seq and not seq & 1:
+                # seq が変わったときだけ中身を読む
+                last_seq = seq
+                snapshot = self.read()
+                if snapshot is not None and snapshot.frame > after_frame:
+                    return snapshot
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+
+def claim_stale_block(name):
+    """残っている同名のブロックが、止まった書き込み側のものなら接続して返す"""
+    shm = attach(name)
+    # Linux では作成時のサイズ、macOS などではページ単位に切り上げたサイズになる
+    page_rounded = -(-BLOCK_SIZE // mmap.PAGESIZE) * mmap.PAGESIZE
+    if shm.size not in (BLOCK_SIZE, page_rounded):
+        shm.close()
+        raise FileExistsError(f"shared memory block {name!r} exists with an unexpected size ({shm.size} bytes); choose another name")
+    owner = struct.unpack_from(OWNER_FORMAT, shm.buf, OWNER_OFFSET)[0]
+    if owner:
+        in_use = process_alive(owner)
+    else:
+        # 作成直後でまだプロセスIDが書かれていない。1フレーム以上書き終えていて、かつ止まっていれば残骸とみなす
+        seq = struct.unpack_from(SEQ_FORMAT, shm.buf, 0)[0]
+        time.sleep(LIVENESS_CHECK)
+        in_use = seq == 0 or seq & 1 or struct.unpack_from(SEQ_FORMAT, shm.buf, 0)[0] != seq
+    if in_use:
+        shm.close()
+        raise FileExistsError(f"shared memory block {name!r} is in use by another running game; choose another name")
+    if getattr(shm, "_track", True):
+        # 古い Python では close() 後の unlink() が登録解除するので、書き込み側として登録しておく
+        resource_tracker.register(shm._name, "shared_memory")
+    return shm
+
+
+def process_alive(pid):
+    """pid のプロセスが動いているか"""
+    if os.name == "nt":
+        # Windows では共有メモリは使う側がいなくなると消えるので、残っていれば使用中。
+        # (os.kill(pid, 0) は Windows ではプロセスを終了させてしまう)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True # 別のユーザーのプロセス
+    return True
+
+
+def attach(name):
+    """既存の共有メモリに接続する。読み込み側が終了しても削除されないようにする"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13 以降
+    except TypeError:
+        # 古い Python では接続しただけでも resource_tracker に登録され、終了時に削除されてしまう
+        # (後から unregister すると、同じ resource_tracker を使う書き込み側の登録まで消える)
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _publish_headless(name, fps, frames, ready):
+    """遅延計測用: ヘッドレスの Pinball を fps で動かして状態を公開する"""
+    from main import Pinball
+
+    publisher = StatePublisher(name)
+    ready.set()
+    game = Pinball()
+    game.frame_listeners.append(publisher.publish)
+    frame_time = 1.0 / fps
+    next_frame = time.monotonic()
+    try:
+        for i in range(frames):
+            game.update({"plunger": i % 90 < 20, "flipper_l": i % 30 < 5, "flipper_r": i % 30 < 5})
+            next_frame += frame_time
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+    finally:
+        time.sleep(0.2) # 読み込み側が最後のフレームを読み終えるのを待つ
+        publisher.close()
+
+
+def measure_latency(name=DEFAULT_NAME, fps=30, frames=300):
+    """別プロセスで公開される各フレームが何秒後に読めたかを計測する"""
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=_publish_headless, args=(name, fps, frames, ready))
+    process.start()
+    ready.wait()
+
+    reader = StateReader(name)
+    latencies = []
+    missed = 0
+    last_frame = -1
+    while process.is_alive():
+        snapshot = reader.wait_for_frame(last_frame, timeout=0.5)
+        if snapshot is None:
+            continue
+        latencies.append(time.monotonic() - snapshot.published_at)
+        if last_frame >= 0:
+            # 最初のフレームは読み込み側の起動より前に書かれることがあるので数えない
+            missed += snapshot.frame - last_frame - 1
+        last_frame = snapshot.frame
+        if last_frame == frames - 1:
+            break
+    reader.close()
+    process.join()
+
+    latencies.sort()
+    frame_time = 1.0 / fps
+    return {
+        "frames": len(latencies),
+        "missed": missed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000.0,
+        "max_ms": latencies[-1] * 1000.0,
+        "within_one_frame": latencies[-1] < frame_time and missed == 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the live pinball state from shared memory")
+    parser.add_argument("--name", default=DEFAULT_NAME)
+    parser.add_argument("--latency", action="store_true", help="run a headless game and measure publish-to-read latency")
+    args = parser.parse_args()
+
+    if args.latency:
+        print(measure_latency(args.name))
+    else:
+        reader = StateReader(args.name)
+        last_frame = -1
+        while True:
+            snapshot = reader.wait_for_frame(last_frame, timeout=5.0)
+            if snapshot is None:
+                break
+            last_frame = snapshot.frame
+            print(snapshot)
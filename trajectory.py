@@ -0,0 +1,192 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+
+from main import EVENT_DRAIN, EVENT_LAUNCH, Pinball
+
+# ゲームの軌跡 (フレームごとのボール位置とイベント) を固定長レコードで保存するアーカイブ
+#
+# データファイル <path>:
+#   1レコード = 1フレーム (RECORD_SIZE バイト, リトルエンディアン)
+#   frame (uint32), ball_x, ball_y, ball_vx, ball_vy, flipper_l_deg, flipper_r_deg (float32),
+#   events (uint16, main.EVENT_* のビットフラグ), パディング 2バイト
+# インデックスファイル <path>.idx:
+#   1ゲーム = (先頭レコード番号, レコード数) の uint64 x 2
+#
+# 書き込みはチャンク単位でまとめて追記し、読み込みは mmap からチャンク単位でコピーして行う。
+# (mmap を指すバッファを外に渡さないので、イテレータが残っていてもアーカイブを close できる)
+
+RECORD_FORMAT = "<I6fH2x"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT) # 32バイト
+INDEX_FORMAT = "<QQ"
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+
+DEFAULT_CHUNK_RECORDS = 65536 # 書き込み/読み込みのチャンクのレコード数 (2MB)
+
+
+class TrajectoryWriter:
+    def __init__(self, path, chunk_records=DEFAULT_CHUNK_RECORDS):
+        self.path = path
+        self.chunk_records = chunk_records
+        # 既存のアーカイブがあれば追記する
+        truncate_unindexed(path)
+        self.data_file = open(path, "ab")
+        self.index_file = open(path + ".idx", "ab")
+        self.total_records = self.data_file.tell() // RECORD_SIZE
+
+        self.buffer = bytearray(chunk_records * RECORD_SIZE)
+        self.buffered = 0 # buffer に溜まっているレコード数
+        self.game_start = None
+        self.frame = 0
+
+    def begin_game(self):
+        """新しいゲームの記録を始める"""
+        if self.game_start is not None:
+            self.end_game()
+        self.game_start = self.total_records + self.buffered
+        self.frame = 0
+
+    def record(self, game):
+        """Pinball の現在のフレームを1レコード追加する (Pinball.frame_listeners に登録して使う)"""
+        struct.pack_into(
+            RECORD_FORMAT, self.buffer, self.buffered * RECORD_SIZE,
+            self.frame,
+            game.ball_x, game.ball_y, game.ball_vx, game.ball_vy,
+            game.flipper_angle_l_deg, game.flipper_angle_r_deg,
+            game.frame_events,
+        )
+        self.frame += 1
+        self.buffered += 1
+        if self.buffered == self.chunk_records:
+            self.flush()
+
+    def end_game(self):
+        """記録中のゲームを閉じてインデックスに追加する"""
+        if self.game_start is None:
+            return
+        count = self.total_records + self.buffered - self.game_start
+        self.index_file.write(struct.pack(INDEX_FORMAT, self.game_start, count))
+        self.game_start = None
+
+    def flush(self):
+        """溜まっているレコードをファイルに書き出す"""
+        if self.buffered:
+            self.data_file.write(memoryview(self.buffer)[:self.buffered * RECORD_SIZE])
+            self.total_records += self.buffered
+            self.buffered = 0
+
+    def close(self):
+        self.end_game()
+        self.flush()
+        self.data_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def truncate_unindexed(path):
+    """前回の書き込みが途中で終わっていた場合に、インデックスにないレコードを捨てる
+
+    書きかけのレコードが残ったまま追記すると、それ以降のレコードの位置がすべてずれる
+    """
+    index_path = path + ".idx"
+    if not os.path.exists(path):
+        return
+    indexed_records = 0
+    if os.path.exists(index_path):
+        # インデックスの書きかけのエントリも捨てる
+        index_size = os.path.getsize(index_path) // INDEX_SIZE * INDEX_SIZE
+        os.truncate(index_path, index_size)
+        if index_size:
+            with open(index_path, "rb") as index_file:
+                index_file.seek(index_size - INDEX_SIZE)
+                start, count = struct.unpack(INDEX_FORMAT, index_file.read(INDEX_SIZE))
+            indexed_records = start + count # ゲームは順に追記されるので最後のエントリが末尾
+    data_size = os.path.getsize(path)
+    if data_size > indexed_records * RECORD_SIZE:
+        print(f"{path}: dropping {data_size - indexed_records * RECORD_SIZE} bytes after the last indexed game")
+        os.truncate(path, indexed_records * RECORD_SIZE)
+
+
+class TrajectoryArchive:
+    def __init__(self, path):
+        self.path = path
+        self._data_file = open(path, "rb")
+        self.num_records = os.fstat(self._data_file.fileno()).st_size // RECORD_SIZE
+        # 空ファイルは mmap できない
+        self._data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ) if self.num_records else b""
+
+        # インデックスはゲーム数 x 16バイトと小さいので読み込んでおく
+        with open(path + ".idx", "rb") as index_file:
+            self.games = list(struct.iter_unpack(INDEX_FORMAT, index_file.read()))
+
+    def __len__(self):
+        """記録されているゲーム数"""
+        return len(self.games)
+
+    def game(self, index):
+        """index 番目のゲームのレコードを (frame, x, y, vx, vy, flipper_l, flipper_r, events) のタプルで返す"""
+        start, count = self.games[index]
+        return struct.iter_unpack(RECORD_FORMAT, self._data[start * RECORD_SIZE:(start + count) * RECORD_SIZE])
+
+    def iter_chunks(self, chunk_records=DEFAULT_CHUNK_RECORDS):
+        """アーカイブ全体をチャンク単位で読む。チャンクごとにレコードのイテレータを返す"""
+        for start in range(0, self.num_records, chunk_records):
+            end = min(start + chunk_records, self.num_records)
+            yield struct.iter_unpack(RECORD_FORMAT, self._data[start * RECORD_SIZE:end * RECORD_SIZE])
+
+    def close(self):
+        if self.num_records:
+            self._data.close()
+        self._data_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def autoplay_inputs(game, launch_frames):
+    """簡単な自動プレイ: 引いて発射し、ボールがフリッパーに近づいたらフリッパーを上げる"""
+    if game.game_state == "READY":
+        return {"plunger": game.plunger_pull_time < launch_frames}
+    flip = game.ball_y > game.flipper_l_pivot_y - 40
+    return {"flipper_l": flip and game.ball_x < game.WIDTH / 2, "flipper_r": flip and game.ball_x >= game.WIDTH / 2}
+
+
+def simulate(path, games, max_frames=30 * 60 * 10, seed=None):
+    """自動プレイで games ゲーム分シミュレーションしてアーカイブに追記する"""
+    if seed is not None:
+        random.seed(seed) # Pinball 側の乱数 (バンパーの反射角など) も再現できるようにする
+    with TrajectoryWriter(path) as writer:
+        for _ in range(games):
+            game = Pinball()
+            game.build_static_field(incremental=False) # キャッシュがなければ最初のゲームで一度だけ作る
+            game.frame_listeners.append(writer.record)
+            writer.begin_game()
+            launch_frames = random.randint(5, 40)
+            for _ in range(max_frames):
+                game.update(autoplay_inputs(game, launch_frames))
+                if game.game_state == "GAME_OVER":
+                    break
+                if game.frame_events & (EVENT_LAUNCH | EVENT_DRAIN):
+                    # 発射やボールロストのたびに引く長さを変える
+                    launch_frames = random.randint(5, 40)
+            writer.end_game()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate games and append their trajectories to an archive")
+    parser.add_argument("path")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--max-frames", type=int, default=30 * 60 * 10)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    simulate(args.path, args.games, args.max_frames, args.seed)